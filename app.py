@@ -1,19 +1,93 @@
 import streamlit as st
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from datetime import datetime
-import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
 
+pio.json.config.default_engine = "orjson"  # Serialize figures with orjson
 
-def determine_type(dataset_type: str) -> str:
-    if "[" in dataset_type and "]" in dataset_type:
-        return "Derived"
-    else:
-        return "Primary"
 
+DATASET_STATUSES = ["Primary", "Derived"]
+PRIMARY_CODE = DATASET_STATUSES.index("Primary")  # Categorical code of "Primary"
+CATEGORICAL_COLUMNS = ["dataset_type", "group_name", "status"]
 
-@st.cache_data
+LOGO_URL = "https://hubmapconsortium.org/wp-content/uploads/2019/01/HuBMAP-Retina-Logo-Color-300x110.png"
+TABLE_OF_CONTENTS = """
+- [Introduction](#introduction)
+- [Report](#report)
+"""
+FOOTER_HTML = """
+<style>
+.footer {
+    position: fixed;
+    left: 0;
+    bottom: 0;
+    width: 100%;
+    background-color: white;
+    color: black;
+    text-align: center;
+}
+</style>
+<div class="footer">
+    <p>© 2024 Pittsburgh Supercomputing Center. All Rights Reserved.</p>
+</div>
+"""
+
+
+def determine_type(dataset_type: pd.Series) -> pd.Categorical:
+    """
+    Label each dataset as 'Derived' if its type contains brackets, 'Primary' otherwise.
+
+    Parameters:
+    dataset_type (pd.Series): The 'dataset_type' column.
+
+    Returns:
+    pd.Categorical: The dataset status with categories DATASET_STATUSES.
+    """
+    s = dataset_type.astype("string")
+    mask = s.str.contains("[", regex=False, na=False) & s.str.contains(
+        "]", regex=False, na=False
+    )
+    return pd.Categorical.from_codes(
+        mask.to_numpy(dtype=np.int8), categories=DATASET_STATUSES
+    )
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """
+    Create a requests session with connection pooling and retries.
+
+    The session is shared across reruns and user sessions so that
+    TCP/TLS connections to the ingest API are reused.
+
+    Returns:
+    requests.Session: The configured session.
+    """
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=retries)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_resource
+def get_last_response() -> dict:
+    """
+    Hold the validators (ETag/Last-Modified) and the JSON payload of the
+    last successful fetch so the next fetch can be a conditional request.
+
+    Returns:
+    dict: A mutable dictionary shared across reruns and user sessions.
+    """
+    return {}
+
+
+@st.cache_data(ttl=3600)
 def get_data() -> pd.DataFrame:
     """
     Fetch data from a predefined URL, extract the 'data' key,
@@ -23,17 +97,38 @@ def get_data() -> pd.DataFrame:
     pd.DataFrame: The data extracted from the 'data' key loaded into a DataFrame.
     """
     url = "https://ingest.api.hubmapconsortium.org/datasets/data-status"  # The URL to get the data from
+    last_response = get_last_response()
+    headers = {}
+    if "etag" in last_response:  # Let the server answer 304 if nothing changed
+        headers["If-None-Match"] = last_response["etag"]
+    if "last_modified" in last_response:
+        headers["If-Modified-Since"] = last_response["last_modified"]
+
     try:
-        response = requests.get(url)  # Send a request to the URL to get the data
-        response.raise_for_status()  # Check if the request was successful (no errors)
-        json_data = response.json()  # Convert the response to JSON format
+        response = get_session().get(
+            url, headers=headers, timeout=(3.05, 30)
+        )  # Send a request to the URL to get the data
+        if response.status_code == 304 and "json" in last_response:
+            json_data = last_response["json"]  # Reuse the payload from the last fetch
+        else:
+            response.raise_for_status()  # Check if the request was successful (no errors)
+            json_data = orjson.loads(response.content)  # Convert the response to JSON format
+
+            last_response.clear()
+            last_response["json"] = json_data
+            if "ETag" in response.headers:
+                last_response["etag"] = response.headers["ETag"]
+            if "Last-Modified" in response.headers:
+                last_response["last_modified"] = response.headers["Last-Modified"]
 
         # Ensure 'data' key exists in the JSON
         if "data" in json_data:  # Check if the JSON contains the key 'data'
-            df = pd.DataFrame(
-                json_data["data"]
-            )  # Create a DataFrame using the data under 'data' key
-            df["dataset_status"] = df["dataset_type"].apply(determine_type)
+            df = pd.DataFrame(json_data["data"]).convert_dtypes(
+                dtype_backend="pyarrow"
+            )  # Create a DataFrame using the data under 'data' key, backed by Arrow
+            df["dataset_status"] = determine_type(df["dataset_type"])
+            for column in CATEGORICAL_COLUMNS:  # Group on integer codes, not strings
+                df[column] = df[column].astype("category")
             print("Data successfully loaded.")  # Print a message indicating success
         else:
             raise KeyError(
@@ -49,49 +144,147 @@ def get_data() -> pd.DataFrame:
         return pd.DataFrame()  # Return an empty DataFrame if the request fails
 
 
-def get_list_of_unique_status(df):
-    all_statuses = df["status_history"].apply(lambda x: [d["status"] for d in x])
-    unique_statuses = list(
-        set([status for sublist in all_statuses for status in sublist])
+def get_list_of_unique_status(df: pd.DataFrame) -> list:
+    """
+    List every status that appears in the datasets' status histories.
+
+    Parameters:
+    df (pd.DataFrame): The data returned by get_data.
+
+    Returns:
+    list: 'HuBMAP ID' followed by the unique statuses, in order of first appearance.
+    """
+    statuses = df["status_history"].explode().dropna().str.get("status")
+    return ["HuBMAP ID", *statuses.dropna().unique()]
+
+
+@st.cache_data
+def count_datasets(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Count the rows for each combination of values in a DataFrame's columns.
+
+    Parameters:
+    df (pd.DataFrame): The columns to count combinations of.
+
+    Returns:
+    pd.DataFrame: One row per observed combination, nulls included, with its
+        count in column 'n'.
+    """
+    # observed=True skips the category combinations that never occur. Nulls are
+    # kept here and dropped later by count_pairs, only in each chart's own columns.
+    return (
+        df.groupby(df.columns.tolist(), observed=True, sort=False, dropna=False)
+        .size()
+        .reset_index(name="n")
+    )
+
+
+@st.cache_data
+def count_pairs(
+    counts: pd.DataFrame, index: str, columns: str, sort_by_total: bool = False
+) -> pd.DataFrame:
+    """
+    Total the counts for each pair of values of two columns.
+
+    Parameters:
+    counts (pd.DataFrame): The counts, as returned by count_datasets.
+    index (str): The column whose values become the index of the result.
+    columns (str): The column whose values become the columns of the result.
+    sort_by_total (bool): Whether to sort the rows by their total count, largest first.
+
+    Returns:
+    pd.DataFrame: The counts, with columns sorted alphabetically.
+    """
+    agg_df = (
+        counts.groupby([index, columns], observed=True)["n"]
+        .sum()
+        .unstack(fill_value=0)
+    )
+
+    if sort_by_total:  # Sort the rows by the total count for each row
+        totals = agg_df.to_numpy().sum(axis=1)
+        agg_df = agg_df.iloc[np.argsort(-totals, kind="stable")]
+
+    agg_df = agg_df.sort_index(axis=1)  # Sort columns alphabetically
+
+    # Store the counts in the smallest unsigned integer type that holds them
+    return agg_df.astype(np.min_scalar_type(agg_df.to_numpy().max(initial=0)))
+
+
+@st.cache_data
+def build_stacked_bar_chart(
+    agg_df: pd.DataFrame,
+    title: str,
+    legend_title: str,
+    height: int,
+    width: int | None = None,
+) -> go.Figure:
+    """
+    Build a stacked bar chart with one go.Bar trace per column of a count matrix.
+
+    The traces are built straight from NumPy arrays rather than through
+    Plotly Express, which would first copy the frame with reset_index.
+
+    Parameters:
+    agg_df (pd.DataFrame): The counts, as returned by count_pairs.
+    title (str): The chart title.
+    legend_title (str): The label for the stacked columns.
+    height (int): The figure height in pixels.
+    width (int | None): The figure width in pixels, or None to let Plotly decide.
+
+    Returns:
+    go.Figure: The bar chart.
+    """
+    x = agg_df.index.to_numpy()
+    fig = go.Figure()
+    for column, values in zip(agg_df.columns, agg_df.to_numpy().T):
+        fig.add_trace(go.Bar(name=str(column), x=x, y=values))
+    fig.update_layout(
+        title=title,
+        barmode="stack",
+        bargap=0.1,
+        height=height,
+        width=width,
+        legend_title_text=legend_title,
+        yaxis_title="Count",
+        uirevision=title,  # Keep zoom and legend state across reruns
     )
-    return unique_statuses.insert(0, "HuBMAP ID")
+
+    # Customize the x-axis tick labels
+    fig.update_xaxes(tickangle=45, title_text=agg_df.index.name)
+    return fig
 
 
 data = get_data()
-df = data[data["dataset_status"] == "Primary"].copy()
+df_primary = (
+    data.loc[data["dataset_status"].cat.codes.to_numpy() == PRIMARY_CODE]
+    .rename(
+        columns={
+            "hubmap_id": "HuBMAP ID",
+            "dataset_type": "Dataset Type",
+            "group_name": "Group Name",
+            "status": "Status",
+            "uuid": "UUID",
+        }
+    )
+    .assign(**{"Status Change": None})
+)
+
+# Count the primary datasets once and reuse the counts for both charts
+counts = count_datasets(df_primary[["Dataset Type", "Group Name", "Status"]])
 
 #########################################################################################################################
 # Add a sidebar
+# Static elements are drawn on every full rerun: Streamlit clears any element
+# a run does not emit, so they cannot be skipped once they have been shown.
 st.sidebar.title("")
-logo_url = "https://hubmapconsortium.org/wp-content/uploads/2019/01/HuBMAP-Retina-Logo-Color-300x110.png"
-st.sidebar.image(logo_url, use_column_width=True)
+st.sidebar.image(LOGO_URL, use_column_width=True)
 
 st.sidebar.title("Table of Contents")
-st.sidebar.markdown(
-    """
-- [Introduction](#introduction)
-- [Report](#report)
-""",
-    unsafe_allow_html=True,
-)
+st.sidebar.markdown(TABLE_OF_CONTENTS, unsafe_allow_html=True)
 #########################################################################################################################
 
 #########################################################################################################################
-df.rename(
-    columns={"dataset_type": "Dataset Type", "group_name": "Group Name"}, inplace=True
-)
-
-# Aggregate the data by Group Name first, then Dataset Type
-agg_df = df.groupby(["Group Name", "Dataset Type"]).size().unstack(fill_value=0)
-
-# Calculate the total count for each Group Name and sort by it
-agg_df["Total"] = agg_df.sum(axis=1)
-agg_df = agg_df.sort_values(by="Total", ascending=False)
-agg_df = agg_df.drop(columns="Total")  # Drop the 'Total' column after sorting
-
-# Sort columns alphabetically (optional, depending on your needs)
-agg_df = agg_df.sort_index(axis=1)
-
 # Create the Streamlit app
 st.header("Primary Datasets Report")
 
@@ -101,129 +294,76 @@ st.write(today)
 st.subheader("Introduction")
 st.text("The goal of the Human BioMolecular Atlas Program (HuBMAP) is to develop an open and global platform to map healthy cells in the human body.")
 
-# Add the plot
-st.subheader("Report")
-
-# Rename columns
-df.rename(columns={'dataset_type': 'Dataset Type', 'group_name':'Group Name'}, inplace=True)
 
-# Aggregate the data by Dataset Type first, then Group Name
-agg_df = df.groupby(['Dataset Type', 'Group Name']).size().unstack(fill_value=0)
+@st.fragment
+def render_primary_by_provider(counts: pd.DataFrame):
+    """
+    Render the chart of primary datasets by dataset type and data provider.
 
-# Sort columns alphabetically (optional)
-agg_df = agg_df.sort_index(axis=1)
+    Parameters:
+    counts (pd.DataFrame): The primary dataset counts, as returned by count_datasets.
+    """
+    # Add the plot
+    st.subheader("Report")
+
+    # Aggregate the data by Dataset Type first, then Group Name
+    agg_df = count_pairs(counts, "Dataset Type", "Group Name")
+
+    # Create a Plotly bar chart
+    fig = build_stacked_bar_chart(
+        agg_df,
+        title="Published and unpublished primary datasets by dataset type vs data provider",
+        legend_title="Group Name",
+        height=1000,
+    )
 
-# Create a Plotly bar chart
-fig = px.bar(
-    agg_df.reset_index(),  # Reset index to use it in Plotly
-    x='Dataset Type',  # x-axis is now Dataset Type
-    y=agg_df.columns,  # The columns are now Group Names
-    title=f'Published and unpublished primary datasets by dataset type vs data provider',
-    labels={'value': 'Count', 'variable': 'Group Name'},
-    barmode='stack',
-    width=1600,  # Increase figure width
-    height=1000   # Increase figure height
-)
+    # Display the Plotly figure in Streamlit
+    st.plotly_chart(fig, width="stretch")
 
-# Customize the x-axis tick labels
-fig.update_xaxes(tickangle=45, title_text="Dataset Type")
 
-# Display the Plotly figure in Streamlit
-st.plotly_chart(fig)
+render_primary_by_provider(counts)
 #########################################################################################################################
 
 #########################################################################################################################
-import streamlit as st
-import pandas as pd
-import plotly.express as px
-
-# Assuming df is your DataFrame
-# df = pd.read_csv('your_file.csv')
-
-# Rename columns
-df.rename(
-    columns={
-        "dataset_type": "Dataset Type",
-        "group_name": "Group Name",
-        "status": "Status",
-    },
-    inplace=True,
-)
 
-# Aggregate the data by Dataset Type and Status
-agg_df = df.groupby(["Dataset Type", "Status"]).size().unstack(fill_value=0)
+@st.fragment
+def render_status_chart(counts: pd.DataFrame):
+    """
+    Render the chart of primary datasets by dataset type and status.
 
-# Calculate the total count for each Dataset Type and sort by it
-agg_df["Total"] = agg_df.sum(axis=1)
-agg_df = agg_df.sort_values(by="Total", ascending=False)
-agg_df = agg_df.drop(columns="Total")  # Drop the 'Total' column after sorting
+    Parameters:
+    counts (pd.DataFrame): The primary dataset counts, as returned by count_datasets.
+    """
+    # Aggregate the data by Dataset Type and Status
+    agg_df = count_pairs(counts, "Dataset Type", "Status", sort_by_total=True)
+
+    # Create the Streamlit app
+    st.header("Published and Unpublished Primary Dataset Status Report")
+
+    # Add the plot
+    st.subheader("Datasets by Status")
+
+    # Create a Plotly bar chart
+    fig = build_stacked_bar_chart(
+        agg_df,
+        title="Published and unpublished primary dataset status",
+        legend_title="Status",
+        height=800,
+        width=1200,
+    )
 
-# Sort columns alphabetically (optional)
-agg_df = agg_df.sort_index(axis=1)
+    # Display the Plotly figure in Streamlit
+    st.plotly_chart(fig)
 
-# Create the Streamlit app
-st.header("Published and Unpublished Primary Dataset Status Report")
-
-# Add the plot
-st.subheader("Datasets by Status")
-
-# Create a Plotly bar chart
-fig = px.bar(
-    agg_df.reset_index(),  # Reset index to use it in Plotly
-    x="Dataset Type",
-    y=agg_df.columns,
-    title=f"Published and unpublished primary dataset status",
-    labels={"value": "Count", "variable": "Status"},
-    barmode="stack",
-    width=1200,  # Adjust figure width
-    height=800,  # Adjust figure height
-)
 
-# Customize the x-axis tick labels
-fig.update_xaxes(tickangle=45, title_text="Dataset Type")
-
-# Display the Plotly figure in Streamlit
-st.plotly_chart(fig)
+render_status_chart(counts)
 #########################################################################################################################
 
 #########################################################################################################################
-df = data[data["dataset_status"] == "Primary"].copy()
-df.rename(
-    columns={
-        "hubmap_id": "HuBMAP ID",
-        "dataset_type": "Dataset Type",
-        "group_name": "Group Name",
-        "hubmap_id": "HuBMAP ID",
-        "uuid": "UUID",
-    },
-    inplace=True,
-)
-df["Status Change"] = None
-
-df.reset_index(drop=True)
-
-#st.dataframe(df[["HuBMAP ID", "UUID", "Dataset Type", "Status Change"]])
+#st.dataframe(df_primary[["HuBMAP ID", "UUID", "Dataset Type", "Status Change"]])
 #########################################################################################################################
 
 #########################################################################################################################
 # Add a copyright notice at the bottom
-st.markdown(
-    """
-    <style>
-    .footer {
-        position: fixed;
-        left: 0;
-        bottom: 0;
-        width: 100%;
-        background-color: white;
-        color: black;
-        text-align: center;
-    }
-    </style>
-    <div class="footer">
-        <p>© 2024 Pittsburgh Supercomputing Center. All Rights Reserved.</p>
-    </div>
-    """,
-    unsafe_allow_html=True,
-)
+st.markdown(FOOTER_HTML, unsafe_allow_html=True)
 #########################################################################################################################
\ No newline at end of file